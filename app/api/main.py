@@ -1,40 +1,102 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 import logging
 from .routers.mcp_tools import router as tools_router
 from .routers.mcp_resources import router as resources_router
 from .routers.agent import router as agent_router
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+import asyncio
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("api")
 
+def start_queue_logging() -> QueueListener:
+    """将根日志处理器移到后台线程，事件循环中只做入队操作，避免日志I/O阻塞请求"""
+    root_logger = logging.getLogger()
+    handlers = root_logger.handlers[:]
+    listener = QueueListener(SimpleQueue(), *handlers, respect_handler_level=True)
+    root_logger.handlers = [QueueHandler(listener.queue)]
+    listener.start()
+    return listener
+
+def stop_queue_logging(listener: QueueListener):
+    """停止后台日志线程并恢复原有的日志处理器"""
+    listener.stop()
+    logging.getLogger().handlers = list(listener.handlers)
+
+async def warmup(app: FastAPI):
+    """后台预热LLM连接池、语义缓存向量模型和MCP工具缓存，避免首个请求承担冷启动开销；失败不影响服务"""
+    from .routers.mcp_tools import load_mcp_definitions, get_llm
+    # 各步骤独立容错，某一步失败不影响其余步骤
+    try:
+        await get_llm().warmup()
+    except Exception as e:
+        logger.warning(f"LLM预热失败: {str(e)}")
+
+    if app.state.mcp_healthy:
+        try:
+            await load_mcp_definitions(app.state.mcp_client)
+        except Exception as e:
+            logger.warning(f"MCP工具缓存预热失败: {str(e)}")
+    logger.info("预热完成")
+
 # 定义生命周期管理
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 应用启动时的操作
+    log_listener = start_queue_logging()
     logger.info("API服务器启动")
+    # 启动时创建共享的LLM实例，未配置API密钥等错误直接终止启动，而不是在每个请求中失败
+    from .routers.mcp_tools import get_llm
+    try:
+        get_llm()
+    except Exception as e:
+        logger.critical(f"创建LLM实例失败，终止启动: {str(e)}")
+        stop_queue_logging(log_listener)
+        raise
+    # 创建MCP客户端连接，保存在 app.state 上供路由依赖注入
+    from .routers.mcp_tools import connect_mcp_client, close_mcp_client, mcp_heartbeat
+    app.state.mcp_client = None
+    app.state.mcp_healthy = False
+    try:
+        await connect_mcp_client(app)
+    except Exception as e:
+        # MCP服务器尚未启动时不阻止API启动，由心跳任务或首个请求重试
+        logger.warning(f"启动时连接MCP服务器失败，稍后重试: {str(e)}")
+    # 启动MCP连接心跳任务和后台预热任务
+    heartbeat_task = asyncio.create_task(mcp_heartbeat(app))
+    warmup_task = asyncio.create_task(warmup(app))
     
     yield  # 应用运行期间
     
     # 应用关闭时的操作
     logger.info("API服务器关闭")
-    
-    # 清理任何全局资源
-    from .routers.mcp_tools import mcp_client
-    if mcp_client is not None:
+    for task in (heartbeat_task, warmup_task):
+        task.cancel()
         try:
-            await mcp_client.__aexit__(None, None, None)
-            logger.info("MCP客户端连接已关闭")
-        except Exception as e:
-            logger.error(f"关闭MCP客户端连接时出错: {str(e)}")
+            await task
+        except asyncio.CancelledError:
+            pass
+    
+    # 关闭MCP客户端连接
+    await close_mcp_client(app)
+
+    # 关闭LLM共享的HTTP连接池
+    from ..llm.openai import close_http_client
+    await close_http_client()
+
+    stop_queue_logging(log_listener)
 
 # 创建FastAPI应用
 app = FastAPI(
     title="FastMCP API",
     description="用于与FastMCP服务交互的API",
     version="1.0.0",
+    default_response_class=ORJSONResponse, # 所有端点默认使用orjson编码响应
     lifespan=lifespan
 )
 
@@ -53,10 +115,10 @@ app.include_router(resources_router)
 app.include_router(agent_router)
 
 # 健康检查端点
+# 健康检查响应是常量，预先序列化，避免每次探测重新编码
+_HEALTH = Response(content=b'{"status":"healthy","version":"1.0.0"}', media_type="application/json")
+
 @app.get("/health")
 async def health_check():
     """API服务器健康检查"""
-    return {
-        "status": "healthy",
-        "version": "1.0.0"
-    } 
\ No newline at end of file
+    return _HEALTH 
@@ -1,12 +1,19 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastmcp import Client
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
-import json
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
+import asyncio
 import logging
+import os
 import re # Import regex
 
-from ...llm.openai import OpenAILLM
-from .mcp_tools import get_mcp_client
+import orjson
+
+from .mcp_tools import (
+    mcp_dep, get_formatted_tools, get_llm, get_tool_validator,
+    tool_result_cache_key, get_cached_tool_result, cache_tool_result,
+)
 
 # 配置日志
 logger = logging.getLogger("agent")
@@ -20,6 +27,162 @@ RESOURCE_READ_PREFIX = "READ_RESOURCE:"
 RESOURCE_READ_PATTERN = re.compile(rf"^{RESOURCE_READ_PREFIX}\s*(\S+)", re.MULTILINE)
 # ------------------------------------
 
+DEFAULT_SYSTEM_MESSAGE = "You are a helpful assistant."
+
+def parse_resource_request(content: str) -> Optional[str]:
+    """解析LLM回复中的资源读取指令，返回请求的资源URI，没有则返回None"""
+    # 快速路径: 指令按约定单独输出，只需检查前缀，普通回复无需正则扫描
+    stripped = content.lstrip()
+    if stripped.startswith(RESOURCE_READ_PREFIX):
+        uri_parts = stripped[len(RESOURCE_READ_PREFIX):].split(None, 1)
+        if uri_parts:
+            return uri_parts[0]
+
+    # 回退: 指令出现在多行回复的后续行中
+    if RESOURCE_READ_PREFIX in content:
+        resource_match = RESOURCE_READ_PATTERN.search(content)
+        if resource_match:
+            return resource_match.group(1).strip()
+    return None
+
+# 资源说明和读取指令组成的系统提示后缀，随资源缓存一起失效: (资源信息列表, 后缀)
+_resource_prompt_cache: Optional[Tuple[List[Dict[str, Any]], str]] = None
+# 使用默认系统消息时的完整系统消息字典，各请求共享同一个对象 (只读，不可修改)
+_default_system_msg: Optional[Dict[str, str]] = None
+
+def get_resource_prompt(available_resources_info: List[Dict[str, Any]]) -> str:
+    """获取附加在系统消息后的资源说明和读取指令，资源列表不变时复用"""
+    global _resource_prompt_cache, _default_system_msg
+
+    # 资源缓存重建后列表对象会变化，此时重新生成
+    if _resource_prompt_cache is None or _resource_prompt_cache[0] is not available_resources_info:
+        _default_system_msg = None
+        resource_prompt_part = "\n\nAvailable Resources (you can request to read them using 'READ_RESOURCE: <uri>'):\n" + "\n".join([f"- {res['uri']} ({res['type']})" for res in available_resources_info])
+        instruction_prompt_part = f"\n\nIf you need information from a resource to answer the user, output *only* '{RESOURCE_READ_PREFIX} <uri>' on a line by itself. Otherwise, respond to the user or call a tool if necessary."
+        _resource_prompt_cache = (available_resources_info, resource_prompt_part + instruction_prompt_part)
+    return _resource_prompt_cache[1]
+
+def get_system_message(system_message: Optional[str], available_resources_info: List[Dict[str, Any]]) -> Dict[str, str]:
+    """构建包含资源信息和读取指令的系统消息，未指定系统消息时复用缓存的默认消息字典"""
+    global _default_system_msg
+
+    resource_prompt = get_resource_prompt(available_resources_info)
+    if system_message:
+        return {"role": "system", "content": system_message + resource_prompt}
+
+    if _default_system_msg is None:
+        _default_system_msg = {"role": "system", "content": DEFAULT_SYSTEM_MESSAGE + resource_prompt}
+    return _default_system_msg
+
+def dumps(obj: Any) -> str:
+    """使用orjson序列化为JSON字符串 (tool消息内容)"""
+    return orjson.dumps(obj).decode()
+
+# --- 并发限制 ---
+# 限制同时进行的OpenAI请求数，避免触发速率限制后的429连锁重试
+_llm_semaphore = asyncio.Semaphore(int(os.getenv("LLM_MAX_CONCURRENCY", "32")))
+# 限制同时进行的MCP请求数，按MCP服务器的处理能力调整
+_mcp_semaphore = asyncio.Semaphore(int(os.getenv("MCP_MAX_CONCURRENCY", "16")))
+# ------------------------------------
+
+async def chat_completion(llm, **kwargs):
+    """在并发限制内调用LLM的chat completions接口"""
+    async with _llm_semaphore:
+        return await llm.chat_completion(**kwargs)
+
+async def call_mcp_tool(mcp_client, function_name: str, function_args: Dict[str, Any]):
+    """在并发限制内调用MCP工具"""
+    async with _mcp_semaphore:
+        return await mcp_client.call_tool(function_name, function_args)
+
+def extract_text_content(result: Any) -> Any:
+    """提取MCP工具结果/资源内容中的文本，避免将对象repr (如 [TextContent(type='text', ...)]) 传给LLM"""
+    if isinstance(result, list) and result and all(hasattr(item, "text") for item in result):
+        return result[0].text if len(result) == 1 else [item.text for item in result]
+    return str(result)
+
+def dump_mcp_content(result: Any) -> Any:
+    """将MCP工具结果/资源内容 (pydantic对象列表) 转换为可直接JSON序列化的数据"""
+    if isinstance(result, list):
+        return [item.model_dump(mode="json") if hasattr(item, "model_dump") else item for item in result]
+    return result
+
+async def execute_tool_calls(mcp_client, tool_calls, tool_calls_executed: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """并发执行同一轮LLM回复中的多个工具调用，按原始顺序返回对应的tool消息"""
+    # 先解析并校验所有参数，解析或校验失败的调用直接返回错误，不会发起MCP请求
+    parsed_calls = [] # (工具调用, 参数, 参数错误)
+    for tool_call in tool_calls:
+        function_name = tool_call["function"]["name"]
+        try:
+            function_args = orjson.loads(tool_call["function"]["arguments"])
+        except orjson.JSONDecodeError as json_err:
+            logger.error("解析工具参数失败 (%s): %s", function_name, json_err)
+            parsed_calls.append((tool_call, None, {"error": "解析参数失败", "details": str(json_err)}))
+            continue
+
+        validator = get_tool_validator(function_name)
+        validation_errors = [error.message for error in validator.iter_errors(function_args)] if validator else []
+        if validation_errors:
+            logger.error("工具参数校验失败 (%s): %s", function_name, validation_errors)
+            parsed_calls.append((tool_call, function_args, {"error": "参数校验失败", "details": validation_errors}))
+        else:
+            parsed_calls.append((tool_call, function_args, None))
+
+    # 命中缓存的调用直接复用结果，其余调用并发请求实际的MCP工具，耗时取决于最慢的工具而非总和
+    cache_keys = {}
+    cached_results = {}
+    pending_calls = []
+    for tool_call, function_args, args_error in parsed_calls:
+        if args_error:
+            continue
+        cache_key = tool_result_cache_key(tool_call["function"]["name"], function_args)
+        cache_keys[id(tool_call)] = cache_key
+        cached_result = get_cached_tool_result(cache_key) if cache_key is not None else None
+        if cached_result is not None:
+            cached_results[id(tool_call)] = cached_result
+        else:
+            logger.info("调用MCP工具: %s，参数: %s", tool_call["function"]["name"], function_args)
+            pending_calls.append((tool_call, function_args))
+    results = iter(await asyncio.gather(
+        *(call_mcp_tool(mcp_client, tool_call["function"]["name"], args) for tool_call, args in pending_calls),
+        return_exceptions=True
+    ))
+
+    tool_messages = []
+    for tool_call, function_args, args_error in parsed_calls:
+        function_name = tool_call["function"]["name"]
+        if args_error:
+            content = dumps(args_error)
+        else:
+            cache_hit = id(tool_call) in cached_results
+            tool_result = cached_results[id(tool_call)] if cache_hit else next(results)
+            if isinstance(tool_result, BaseException):
+                logger.error("调用工具 %s 时出错: %s", function_name, tool_result)
+                content = dumps({"error": f"工具执行失败", "details": str(tool_result)})
+            else:
+                logger.info("工具 %s 返回结果%s", function_name, " (缓存)" if cache_hit else "")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("工具 %s 结果: %r", function_name, tool_result)
+                cache_key = cache_keys[id(tool_call)]
+                if not cache_hit and cache_key is not None:
+                    cache_tool_result(cache_key, tool_result)
+
+                # 记录执行的调用
+                tool_calls_executed.append({"tool_name": function_name, "arguments": function_args, "result": dump_mcp_content(tool_result), "cache_hit": cache_hit})
+
+                # 只传递文本内容，减少下一轮的token
+                content = dumps(extract_text_content(tool_result))
+
+        tool_messages.append(
+            {
+                "tool_call_id": tool_call["id"],
+                "role": "tool",
+                "name": function_name,
+                "content": content,
+            }
+        )
+    return tool_messages
+
 # Pydantic模型
 class AgentRequest(BaseModel):
     prompt: str
@@ -32,101 +195,191 @@ class AgentResponse(BaseModel):
     resources_read: List[Dict[str, Any]] = [] # 记录读取的资源
     iterations: int
 
-@router.post("/process", response_model=AgentResponse)
-async def agent_process(request: AgentRequest):
-    """使用Agent模式处理用户请求，LLM自主选择、调用工具或读取资源"""
-    
-    llm = OpenAILLM() # 初始化LLM
-    mcp_client = await get_mcp_client() # 获取MCP客户端
-    
-    # 1. 获取可用工具和资源列表
+class AgentBatchResponse(BaseModel):
+    batch_id: str
+    status: str
+    request_count: int
+
+class AgentBatchStatusResponse(BaseModel):
+    batch_id: str
+    status: str
+    request_counts: Optional[Dict[str, int]] = None
+    output_file_id: Optional[str] = None
+    error_file_id: Optional[str] = None
+    results: Optional[Dict[str, Any]] = None # 批处理完成后: custom_id -> 回复文本或错误信息
+
+# --- 对话历史窗口 ---
+HISTORY_MAX_MESSAGES = 20 # 消息数超过该值时压缩历史
+HISTORY_KEEP_RECENT = 10 # 压缩后保留的最近消息数
+HISTORY_HEAD = 2 # 系统消息和用户原始请求始终保留
+HISTORY_SUMMARY_PROMPT = "Summarize the following earlier steps of an agent conversation in one line, keeping any facts needed to answer the user."
+# ------------------------------------
+
+async def summarize_messages(llm, elided_messages: List[Dict[str, Any]]) -> str:
+    """将被省略的历史消息压缩为一行摘要，失败时退化为省略说明"""
+    transcript = "\n".join(
+        f"{msg['role']}: {msg.get('content') or dumps(msg.get('tool_calls'))}" for msg in elided_messages
+    )
     try:
-        # Tools
-        available_tools_raw = await mcp_client.list_tools()
-        available_tools_dict = []
-        for tool in available_tools_raw:
-            tool_dict = {
-                "name": tool.name,
-                "description": tool.description,
-                "parameters": []
+        summary_response = await chat_completion(
+            llm,
+            messages=[
+                {"role": "system", "content": HISTORY_SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+            max_tokens=128
+        )
+        summary = summary_response["choices"][0]["message"]["content"]
+        if summary:
+            return summary
+    except Exception as e:
+        logger.warning("生成历史摘要失败: %s", e)
+    return f"{len(elided_messages)} earlier messages were omitted."
+
+async def trim_history(llm, messages: List[Dict[str, Any]]):
+    """历史过长时保留开头的系统消息/用户请求和最近的消息，中间部分替换为一行摘要"""
+    if len(messages) <= HISTORY_MAX_MESSAGES:
+        return
+
+    cut = len(messages) - HISTORY_KEEP_RECENT
+    # 保持工具调用与结果成对: 保留部分不能以tool消息开头，需连同发起调用的assistant消息一起保留
+    while cut > HISTORY_HEAD and messages[cut]["role"] == "tool":
+        cut -= 1
+    if cut <= HISTORY_HEAD:
+        return
+
+    elided_messages = messages[HISTORY_HEAD:cut]
+    summary = await summarize_messages(llm, elided_messages)
+    messages[HISTORY_HEAD:cut] = [{"role": "system", "content": f"Summary of earlier steps: {summary}"}]
+    logger.info("已将 %d 条历史消息压缩为摘要", len(elided_messages))
+
+def to_assistant_message(response_message: Dict[str, Any]) -> Dict[str, Any]:
+    """将响应中的助手消息转换为可直接回传给LLM的消息字典 (去掉 refusal 等多余字段)"""
+    assistant_message = {"role": "assistant", "content": response_message.get("content")}
+    tool_calls = response_message.get("tool_calls")
+    if tool_calls:
+        assistant_message["tool_calls"] = [
+            {
+                "id": tool_call["id"],
+                "type": "function",
+                "function": {"name": tool_call["function"]["name"], "arguments": tool_call["function"]["arguments"]},
             }
-            input_schema = getattr(tool, "inputSchema", None)
-            if input_schema and isinstance(input_schema, dict) and "properties" in input_schema:
-                properties = input_schema.get("properties", {})
-                required_params = input_schema.get("required", [])
-                for param_name, param_details in properties.items():
-                    param_info = {
-                        "name": param_name,
-                        "type": param_details.get("type", "any"),
-                        "description": param_details.get("description", param_details.get("title", "")),
-                        "required": param_name in required_params,
-                        "default": param_details.get("default", None)
-                    }
-                    tool_dict["parameters"].append(param_info)
-            available_tools_dict.append(tool_dict)
-        formatted_tools_for_llm = llm.format_tools(available_tools_dict)
-        logger.info(f"传递给LLM的工具: {formatted_tools_for_llm}")
-        
-        # Resources
-        available_resources_raw = await mcp_client.list_resources()
-        available_resources_info = [ # Create a simple list of resource URIs and types
-            {"uri": res.uri, "type": getattr(res, 'mimeType', 'unknown')}
-            for res in available_resources_raw
+            for tool_call in tool_calls
         ]
-        logger.info(f"可用的资源: {available_resources_info}")
-        
-    except Exception as e:
-        logger.error(f"获取或格式化工具/资源时出错: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"获取工具/资源失败: {str(e)}")
+    return assistant_message
 
-    # 2. 构建初始消息，包含资源信息和读取指令
-    initial_system_message = request.system_message or "You are a helpful assistant."
-    # Append resource info and instructions to the system message
-    resource_prompt_part = "\n\nAvailable Resources (you can request to read them using 'READ_RESOURCE: <uri>'):\n" + "\n".join([f"- {res['uri']} ({res['type']})" for res in available_resources_info])
-    instruction_prompt_part = f"\n\nIf you need information from a resource to answer the user, output *only* '{RESOURCE_READ_PREFIX} <uri>' on a line by itself. Otherwise, respond to the user or call a tool if necessary."
-    
-    enhanced_system_message = initial_system_message + resource_prompt_part + instruction_prompt_part
+async def stream_llm_turn(llm, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], assistant_message: Dict[str, Any]) -> AsyncIterator[str]:
+    """流式调用LLM，确认是最终回复后边接收边产出文本片段；结束后assistant_message中为完整的助手消息"""
+    # 流式响应持续占用一个并发名额，直到读取完毕
+    async with _llm_semaphore:
+        llm_stream = llm.chat_completion_stream(
+            messages=messages,
+            tools=tools,
+            tool_choice="auto"
+        )
 
-    messages = [
-        {"role": "system", "content": enhanced_system_message},
-        {"role": "user", "content": request.prompt}
-    ]
-    
+        content_parts = []
+        tool_calls = {} # index -> 逐步拼接的工具调用
+        forwarding = None # None: 尚未确定; True: 最终回复，转发文本; False: 资源读取指令或工具调用，不转发
+        async for chunk in llm_stream:
+            if not chunk["choices"]:
+                continue
+            delta = chunk["choices"][0]["delta"]
+
+            for tool_call_delta in delta.get("tool_calls") or []:
+                tool_call = tool_calls.setdefault(tool_call_delta["index"], {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                if tool_call_delta.get("id"):
+                    tool_call["id"] = tool_call_delta["id"]
+                function_delta = tool_call_delta.get("function")
+                if function_delta:
+                    tool_call["function"]["name"] += function_delta.get("name") or ""
+                    tool_call["function"]["arguments"] += function_delta.get("arguments") or ""
+            if tool_calls and forwarding is None:
+                forwarding = False
+
+            content = delta.get("content")
+            if not content:
+                continue
+            content_parts.append(content)
+            if forwarding:
+                yield content
+            elif forwarding is None:
+                # 缓冲文本直到能确定回复是否以资源读取指令开头
+                buffered = "".join(content_parts)
+                stripped = buffered.lstrip()
+                if stripped.startswith(RESOURCE_READ_PREFIX):
+                    forwarding = False
+                elif stripped and not RESOURCE_READ_PREFIX.startswith(stripped):
+                    forwarding = True
+                    yield buffered
+
+    assistant_message["role"] = "assistant"
+    assistant_message["content"] = "".join(content_parts) or None
+    if tool_calls:
+        assistant_message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+
+async def run_agent(request: AgentRequest, llm, mcp_client, formatted_tools_for_llm: List[Dict[str, Any]], messages: List[Dict[str, Any]], stream: bool) -> AsyncIterator[Dict[str, Any]]:
+    """Agent循环，产出事件: {"type": "delta"} 为流式回复片段 (仅stream模式)，最后产出一个 {"type": "done"} 事件
+
+    stream模式下文本在确定回复是否为最终回复之前就开始转发；若该轮随后调用了工具或请求读取资源，
+    会产出 {"type": "intermediate"} 事件，表示此前的delta属于中间回复而非最终回复。
+    """
     tool_calls_executed = []
     resources_read = []
     iterations = 0
+    last_assistant_content = None # 最后一条非空的assistant回复，达到最大迭代次数时使用
+    last_assistant_streamed = False # last_assistant_content 是否已通过delta事件发出
 
-    # 3. Agent循环
     while iterations < request.max_iterations:
         iterations += 1
-        logger.info(f"Agent 迭代 {iterations} - 当前消息: {messages}")
+        logger.info("Agent 迭代 %d - 消息数: %d", iterations, len(messages))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Agent 迭代 %d - 当前消息: %r", iterations, messages)
         
         try:
-            # 4. 调用LLM
-            llm_response = await llm.client.chat.completions.create(
-                model=llm.model_name,
-                messages=messages,
-                tools=formatted_tools_for_llm,
-                tool_choice="auto"
-            )
-            
-            response_message = llm_response.choices[0].message
-            response_content = response_message.content or "" # Ensure content is not None
+            # 4. 调用LLM (历史过长时先压缩)
+            await trim_history(llm, messages)
+            turn_streamed = False
+            if stream:
+                response_message = {}
+                async for content_delta in stream_llm_turn(llm, messages, formatted_tools_for_llm, response_message):
+                    turn_streamed = True
+                    yield {"type": "delta", "content": content_delta}
+            else:
+                llm_response = await chat_completion(
+                    llm,
+                    messages=messages,
+                    tools=formatted_tools_for_llm,
+                    tool_choice="auto"
+                )
+                response_message = to_assistant_message(llm_response["choices"][0]["message"])
+
+            response_content = response_message["content"] or "" # Ensure content is not None
+            if response_content:
+                last_assistant_content = response_content
+                last_assistant_streamed = turn_streamed
             messages.append(response_message) # 添加LLM回复 (可能是文本、工具调用或资源读取请求)
             
             # 5. 检查是否请求读取资源
-            resource_match = RESOURCE_READ_PATTERN.search(response_content)
-            if resource_match:
-                resource_uri = resource_match.group(1).strip()
-                logger.info(f"LLM请求读取资源: {resource_uri}")
+            resource_uri = parse_resource_request(response_content)
+            if turn_streamed and (resource_uri or response_message.get("tool_calls")):
+                # 已转发的文本后跟随了工具调用或资源读取指令，告知客户端这些delta是中间回复
+                yield {"type": "intermediate"}
+            if resource_uri:
+                logger.info("LLM请求读取资源: %s", resource_uri)
                 try:
                     # 6. 读取资源
-                    resource_content = await mcp_client.get_resource(resource_uri)
-                    logger.info(f"资源 {resource_uri} 内容: {resource_content}")
-                    resources_read.append({"uri": resource_uri, "content": resource_content})
+                    async with _mcp_semaphore:
+                        resource_content = await mcp_client.read_resource(resource_uri)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("资源 %s 内容: %r", resource_uri, resource_content)
+                    resources_read.append({"uri": resource_uri, "content": dump_mcp_content(resource_content)})
 
                     # --- 修复：将资源结果作为用户消息添加到历史 --- 
-                    resource_feedback_content = f"Content of resource '{resource_uri}':\n\n{str(resource_content)}"
+                    resource_text = extract_text_content(resource_content)
+                    if not isinstance(resource_text, str):
+                        resource_text = "\n\n".join(resource_text)
+                    resource_feedback_content = f"Content of resource '{resource_uri}':\n\n{resource_text}"
                     messages.append(
                         {
                             "role": "user",
@@ -139,7 +392,7 @@ async def agent_process(request: AgentRequest):
                     continue
 
                 except Exception as res_err:
-                    logger.error(f"读取资源 {resource_uri} 时出错: {res_err}")
+                    logger.error("读取资源 %s 时出错: %s", resource_uri, res_err)
                     # --- 修复：将错误信息作为用户消息添加 --- 
                     error_feedback_content = f"Attempted to read resource '{resource_uri}' but failed: {str(res_err)}"
                     messages.append(
@@ -153,77 +406,29 @@ async def agent_process(request: AgentRequest):
                     continue
             
             # 8. 检查是否有实际的工具调用请求
-            elif response_message.tool_calls:
-                logger.info(f"LLM请求调用工具: {response_message.tool_calls}")
-                # 9. 执行工具调用
-                for tool_call in response_message.tool_calls:
-                    function_name = tool_call.function.name
-                    try:
-                        # 解析参数
-                        function_args = json.loads(tool_call.function.arguments)
-                        logger.info(f"调用MCP工具: {function_name}，参数: {function_args}")
-                        
-                        # 调用实际的MCP工具
-                        tool_result = await mcp_client.call_tool(function_name, function_args)
-                        logger.info(f"工具 {function_name} 返回结果: {tool_result}")
-                        
-                        # 记录执行的调用
-                        tool_calls_executed.append({"tool_name": function_name, "arguments": function_args, "result": tool_result})
-                        
-                        # --- 修复：将工具结果转换为JSON可序列化格式 --- 
-                        serializable_result = str(tool_result) # 通用方法，转换为字符串
-                        # 也可以根据需要做更复杂的转换，例如：
-                        # if isinstance(tool_result, list) and len(tool_result) > 0 and hasattr(tool_result[0], 'text'):
-                        #     serializable_result = tool_result[0].text
-                        # else:
-                        #     serializable_result = str(tool_result)
-                        logger.info(f"序列化后的结果: {serializable_result}")
-                        # ---------------------------------------------
-                        
-                        # 10. 将工具结果添加到消息历史，以便LLM处理
-                        messages.append(
-                            {
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": function_name,
-                                # 使用转换后的结果
-                                "content": json.dumps(serializable_result), 
-                            }
-                        )
-                        
-                    except json.JSONDecodeError as json_err:
-                        logger.error(f"解析工具参数失败 ({function_name}): {json_err}")
-                        messages.append(
-                            {
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": function_name,
-                                "content": json.dumps({"error": "解析参数失败", "details": str(json_err)}),
-                            }
-                        )
-                    except Exception as tool_err:
-                        logger.error(f"调用工具 {function_name} 时出错: {tool_err}")
-                        messages.append(
-                            {
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": function_name,
-                                "content": json.dumps({"error": f"工具执行失败", "details": str(tool_err)}),
-                            }
-                        )
+            elif response_message.get("tool_calls"):
+                logger.info("LLM请求调用 %d 个工具", len(response_message["tool_calls"]))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("LLM请求调用工具: %r", response_message["tool_calls"])
+                # 9. 并发执行工具调用，并按原始顺序将工具结果添加到消息历史，以便LLM处理
+                messages.extend(await execute_tool_calls(mcp_client, response_message["tool_calls"], tool_calls_executed))
                 # 处理完工具调用后，继续循环让LLM处理结果
                 continue
             
             else:
-                # 11. 如果既没读资源也没调用工具，返回最终回复
+                # 11. 如果既没读资源也没调用工具，返回最终回复 (stream模式下通常已随delta事件发出)
                 logger.info("LLM未请求资源或工具，生成最终回复")
-                final_response = response_content
-                return AgentResponse(
-                    final_response=final_response,
-                    tool_calls_executed=tool_calls_executed,
-                    resources_read=resources_read,
-                    iterations=iterations
-                )
+                if stream and not turn_streamed and response_content:
+                    # 回复始终停留在资源读取指令前缀的缓冲中 (如 "R" 或不带URI的指令)，一次性补发
+                    yield {"type": "delta", "content": response_content}
+                yield {
+                    "type": "done",
+                    "final_response": response_content,
+                    "tool_calls_executed": tool_calls_executed,
+                    "resources_read": resources_read,
+                    "iterations": iterations,
+                }
+                return
 
         except Exception as llm_err:
             logger.exception("Agent处理过程中调用LLM时出错")
@@ -231,16 +436,145 @@ async def agent_process(request: AgentRequest):
 
     # 12. 达到最大迭代次数
     logger.warning("达到最大迭代次数")
-    final_response = "Agent达到最大迭代次数，未能完全处理请求。"
-    # 尝试获取最后一条assistant消息作为回复
-    for msg in reversed(messages):
-        if msg.role == "assistant" and msg.content:
-            final_response = msg.content
-            break
-            
-    return AgentResponse(
-        final_response=final_response,
-        tool_calls_executed=tool_calls_executed,
-        resources_read=resources_read,
-        iterations=iterations
-    ) 
\ No newline at end of file
+    # 使用最后一条assistant消息作为回复
+    final_response = last_assistant_content or "Agent达到最大迭代次数，未能完全处理请求。"
+    if stream and not last_assistant_streamed:
+        # 回复未流式发出过时才补发，避免客户端重复收到同一段文本
+        yield {"type": "delta", "content": final_response}
+
+    yield {
+        "type": "done",
+        "final_response": final_response,
+        "tool_calls_executed": tool_calls_executed,
+        "resources_read": resources_read,
+        "iterations": iterations,
+    }
+
+async def agent_event_stream(agent_events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """将Agent事件编码为Server-Sent Events"""
+    try:
+        async for event in agent_events:
+            yield f"data: {dumps(event)}\n\n"
+    except HTTPException as e:
+        # 响应头已发送，只能通过事件告知错误
+        yield f"data: {dumps({'type': 'error', 'detail': e.detail})}\n\n"
+
+@router.post("/process", response_model=None, responses={200: {
+    "model": AgentResponse,
+    "description": "stream=false 时返回 AgentResponse (JSON)；默认返回Server-Sent Events",
+    "content": {"text/event-stream": {"schema": {
+        "type": "string",
+        "description": "每个事件为 data: <JSON>，type 为 delta / intermediate / error / done，done事件包含 AgentResponse 的全部字段",
+    }}},
+}})
+async def agent_process(request: AgentRequest, stream: bool = True, mcp_client: Client = Depends(mcp_dep)):
+    """使用Agent模式处理用户请求，LLM自主选择、调用工具或读取资源
+
+    默认以Server-Sent Events流式返回最终回复 (delta事件)，最后发送包含完整结果的done事件；
+    传入 ?stream=false 时返回完整的 AgentResponse。
+    """
+    
+    # 1. 获取共享的LLM实例和可用工具/资源列表 (在MCP连接生命周期内缓存)
+    try:
+        llm = get_llm()
+        formatted_tools_for_llm, available_resources_info = await get_formatted_tools(llm, mcp_client)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("传递给LLM的工具: %r", formatted_tools_for_llm)
+            logger.debug("可用的资源: %r", available_resources_info)
+        
+    except Exception as e:
+        logger.error("获取或格式化工具/资源时出错: %s", e)
+        raise HTTPException(status_code=500, detail=f"获取工具/资源失败: {str(e)}")
+
+    # 2. 构建初始消息，包含资源信息和读取指令
+    messages = [
+        get_system_message(request.system_message, available_resources_info),
+        {"role": "user", "content": request.prompt}
+    ]
+
+    # 3. Agent循环
+    agent_events = run_agent(request, llm, mcp_client, formatted_tools_for_llm, messages, stream)
+    if stream:
+        return StreamingResponse(agent_event_stream(agent_events), media_type="text/event-stream")
+
+    async for event in agent_events:
+        if event["type"] == "done":
+            return ORJSONResponse({
+                "final_response": event["final_response"],
+                "tool_calls_executed": event["tool_calls_executed"],
+                "resources_read": event["resources_read"],
+                "iterations": event["iterations"]
+            })
+
+@router.post("/batch", response_model=AgentBatchResponse)
+async def agent_batch(requests: List[AgentRequest]):
+    """通过OpenAI Batch API异步处理一批单轮请求 (不调用工具/资源)，适合评估、批量分类等非交互场景
+
+    每个请求的 custom_id 为 request-<序号>，通过 GET /api/agent/batch/{batch_id} 轮询结果。
+    """
+    if not requests:
+        raise HTTPException(status_code=400, detail="批处理请求列表不能为空")
+
+    try:
+        llm = get_llm()
+        # 每行一个 /v1/chat/completions 请求 (JSONL)
+        batch_lines = [
+            orjson.dumps({
+                "custom_id": f"request-{index}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": llm.model_name,
+                    "messages": [
+                        {"role": "system", "content": request.system_message or DEFAULT_SYSTEM_MESSAGE},
+                        {"role": "user", "content": request.prompt},
+                    ],
+                },
+            })
+            for index, request in enumerate(requests)
+        ]
+        batch_file = await llm.client.files.create(file=("agent_batch.jsonl", b"\n".join(batch_lines)), purpose="batch")
+        batch = await llm.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+    except Exception as e:
+        logger.exception("提交批处理请求时出错")
+        raise HTTPException(status_code=500, detail=f"提交批处理失败: {str(e)}")
+
+    logger.info("已提交批处理 %s，共 %d 个请求", batch.id, len(requests))
+    return AgentBatchResponse(batch_id=batch.id, status=batch.status, request_count=len(requests))
+
+@router.get("/batch/{batch_id}", response_model=AgentBatchStatusResponse)
+async def agent_batch_status(batch_id: str):
+    """查询批处理状态，完成后返回每个请求的回复"""
+    try:
+        llm = get_llm()
+        batch = await llm.client.batches.retrieve(batch_id)
+
+        results = None
+        if batch.status == "completed" and batch.output_file_id:
+            output = await llm.client.files.content(batch.output_file_id)
+            results = {}
+            for line in output.content.splitlines():
+                if not line.strip():
+                    continue
+                item = orjson.loads(line)
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    results[item["custom_id"]] = {"error": item.get("error") or response.get("body")}
+                else:
+                    results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    except Exception as e:
+        logger.exception("查询批处理 %s 时出错", batch_id)
+        raise HTTPException(status_code=500, detail=f"查询批处理失败: {str(e)}")
+
+    return AgentBatchStatusResponse(
+        batch_id=batch.id,
+        status=batch.status,
+        request_counts=batch.request_counts.model_dump() if batch.request_counts else None,
+        output_file_id=batch.output_file_id,
+        error_file_id=batch.error_file_id,
+        results=results
+    )
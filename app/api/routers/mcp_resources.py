@@ -1,8 +1,10 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from typing import Dict, Any, List
 from pydantic import BaseModel
+from fastmcp import Client
 import logging
-from .mcp_tools import get_mcp_client
+from .mcp_tools import mcp_dep
 
 # 配置日志
 logger = logging.getLogger("mcp_resources")
@@ -18,11 +20,10 @@ class ResourceResponse(BaseModel):
     resource: Any
     uri: str
 
-@router.get("/", response_model=ResourceListResponse)
-async def list_resources():
+@router.get("/", response_model=None, responses={200: {"model": ResourceListResponse}})
+async def list_resources(client: Client = Depends(mcp_dep)):
     """获取所有可用MCP资源"""
     try:
-        client = await get_mcp_client()
         resources = await client.list_resources()
         logger.info(f"获取到的原始资源列表: {resources}")
         
@@ -30,23 +31,21 @@ async def list_resources():
         resource_list = []
         for resource in resources:
             resource_dict = {
-                "uri": resource.uri,
+                "uri": str(resource.uri),
                 # 使用日志中发现的 mimeType 属性
                 "type": getattr(resource, 'mimeType', 'unknown')
             }
             resource_list.append(resource_dict)
         
-        return {"resources": resource_list}
+        return ORJSONResponse({"resources": resource_list})
     except Exception as e:
         logger.exception(f"获取资源列表时发生意外错误")
         raise HTTPException(status_code=500, detail=f"获取资源列表失败: {str(e)}")
 
 @router.get("/{resource_path:path}", response_model=ResourceResponse)
-async def get_resource(resource_path: str):
+async def get_resource(resource_path: str, client: Client = Depends(mcp_dep)):
     """获取指定的MCP资源"""
     try:
-        client = await get_mcp_client()
-        
         # 将路径格式化为data://格式
         full_path = f"data://{resource_path}" if not resource_path.startswith("data://") else resource_path
         
@@ -1,9 +1,16 @@
-from fastapi import APIRouter, HTTPException
-from typing import Dict, Any, List, Optional
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 from pydantic import BaseModel
 from fastmcp import Client
+from jsonschema import Draft7Validator
+from jsonschema.exceptions import SchemaError
+import asyncio
 import logging
+import orjson
 import os
+import time
 from ...llm.openai import OpenAILLM
 
 # 配置日志
@@ -25,100 +32,245 @@ class ToolResponse(BaseModel):
     result: Any
     llm_response: Optional[str] = None
 
-# 全局MCP客户端
-mcp_client = None
+# MCP服务器SSE地址，确保端口与单独运行的MCP服务器匹配
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://localhost:8001/sse")
+# 后台心跳检测间隔 (秒)
+MCP_HEARTBEAT_INTERVAL = float(os.getenv("MCP_HEARTBEAT_INTERVAL", "15"))
 
-# 获取项目根目录的绝对路径
-# 客户端连接异常处理
-async def get_mcp_client():
-    """获取MCP客户端，如未连接则创建连接"""
-    global mcp_client
-    
-    if mcp_client is None:
-        mcp_server_url = "http://localhost:8001/sse" # 确保端口与单独运行的MCP服务器匹配
-        logger.info(f"创建MCP客户端，连接到 SSE 服务器: {mcp_server_url}")
-        # 恢复为连接 SSE 端点
-        mcp_client = Client(transport=mcp_server_url)
+# MCP客户端及其健康标志保存在 app.state 上 (mcp_client / mcp_healthy)，由 lifespan 创建和关闭
+# 防止并发请求和心跳任务同时重连
+_connect_lock = asyncio.Lock()
+
+# 全局LLM实例 (延迟创建)
+_llm_singleton: Optional[OpenAILLM] = None
+
+# 工具/资源缓存: 工具定义在MCP连接生命周期内保持不变，重连时失效
+_tools_cache: Optional[List[Dict[str, Any]]] = None
+# LLM格式化后的工具列表，首次有LLM请求时由工具缓存生成
+_formatted_tools_cache: Optional[List[Dict[str, Any]]] = None
+_resources_cache: Optional[List[Dict[str, Any]]] = None
+# 工具名 -> 参数校验器，与工具缓存同时构建
+_tool_validators: Dict[str, Draft7Validator] = {}
+
+# --- 工具调用结果缓存 (LRU + TTL) ---
+# 默认不缓存: 只有显式列入白名单 (逗号分隔的工具名) 的确定性、无副作用工具才跨请求复用结果
+TOOL_RESULT_CACHE_ALLOWLIST = frozenset(
+    name.strip() for name in os.getenv("AGENT_TOOL_CACHE_ALLOWLIST", "").split(",") if name.strip()
+)
+TOOL_RESULT_CACHE_SIZE = int(os.getenv("AGENT_TOOL_CACHE_SIZE", "256"))
+TOOL_RESULT_CACHE_TTL = float(os.getenv("AGENT_TOOL_CACHE_TTL", "300"))
+# (工具名, 规范化的参数JSON) -> (过期时间, 工具结果)
+_tool_results: "OrderedDict[Tuple[str, bytes], Tuple[float, Any]]" = OrderedDict()
+# ------------------------------------
+
+def invalidate_tools_cache():
+    """清空工具/资源缓存和工具结果缓存，MCP客户端重置或重连时调用"""
+    global _tools_cache, _formatted_tools_cache, _resources_cache, _tool_validators
+    _tools_cache = None
+    _formatted_tools_cache = None
+    _resources_cache = None
+    _tool_validators = {}
+    _tool_results.clear()
+
+def tool_result_cache_key(tool_name: str, arguments: Dict[str, Any]) -> Optional[Tuple[str, bytes]]:
+    """生成工具结果缓存键，工具不在白名单中时返回None"""
+    if TOOL_RESULT_CACHE_SIZE <= 0 or tool_name not in TOOL_RESULT_CACHE_ALLOWLIST:
+        return None
+    return tool_name, orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS)
+
+def get_cached_tool_result(cache_key: Tuple[str, bytes]) -> Optional[Any]:
+    """查询工具结果缓存，未命中或已过期时返回None"""
+    entry = _tool_results.get(cache_key)
+    if entry is None:
+        return None
+    if entry[0] <= time.monotonic():
+        del _tool_results[cache_key]
+        return None
+    _tool_results.move_to_end(cache_key)
+    return entry[1]
+
+def cache_tool_result(cache_key: Tuple[str, bytes], tool_result: Any):
+    """写入工具结果缓存，超出容量时淘汰最久未使用的条目"""
+    _tool_results[cache_key] = (time.monotonic() + TOOL_RESULT_CACHE_TTL, tool_result)
+    _tool_results.move_to_end(cache_key)
+    while len(_tool_results) > TOOL_RESULT_CACHE_SIZE:
+        _tool_results.popitem(last=False)
+
+async def connect_mcp_client(app: FastAPI) -> Client:
+    """关闭旧连接 (如有) 并连接MCP SSE服务器，结果保存在 app.state 上，调用方需持有 _connect_lock"""
+    state = app.state
+    state.mcp_healthy = False
+    invalidate_tools_cache()
+    old_client = getattr(state, "mcp_client", None)
+    state.mcp_client = None
+    if old_client is not None:
         try:
-            await mcp_client.__aenter__() # 异步进入
-            logger.info("已创建并连接到MCP SSE服务器")
-            # 可以在这里加一个快速的 list_tools 调用来验证连接
-            await mcp_client.list_tools() 
-            logger.info("MCP SSE服务器连接验证成功")
+            await old_client.__aexit__(None, None, None) # 先清理旧连接
         except Exception as e:
-            logger.exception(f"连接到MCP SSE服务器 {mcp_server_url} 时出错")
-            mcp_client = None # 连接失败，重置客户端
-            raise HTTPException(status_code=503, detail=f"无法连接到MCP SSE服务器: {e}")
-    
-    # 检查现有连接是否仍然有效
-    if mcp_client:
+            logger.warning(f"清理旧MCP连接时出错: {str(e)}")
+
+    logger.info(f"创建MCP客户端，连接到 SSE 服务器: {MCP_SERVER_URL}")
+    client = Client(transport=MCP_SERVER_URL)
+    await client.__aenter__() # 异步进入
+    state.mcp_client = client
+    state.mcp_healthy = True
+    logger.info("已创建并连接到MCP SSE服务器")
+    return client
+
+async def close_mcp_client(app: FastAPI):
+    """关闭 app.state 上的MCP客户端连接"""
+    client = getattr(app.state, "mcp_client", None)
+    app.state.mcp_client = None
+    app.state.mcp_healthy = False
+    invalidate_tools_cache()
+    if client is not None:
+        try:
+            await client.__aexit__(None, None, None)
+            logger.info("MCP客户端连接已关闭")
+        except Exception as e:
+            logger.error(f"关闭MCP客户端连接时出错: {str(e)}")
+
+async def mcp_dep(request: Request) -> Client:
+    """FastAPI依赖: 返回 lifespan 中创建的MCP客户端，连接不可用时尝试重连"""
+    state = request.app.state
+    # 热路径: 连接状态由心跳任务维护，无需逐请求探测
+    if state.mcp_healthy:
+        return state.mcp_client
+
+    async with _connect_lock:
+        # 等待锁期间可能已被其他请求或心跳任务重连
+        if state.mcp_healthy:
+            return state.mcp_client
         try:
-            if not mcp_client.is_connected(): 
-                logger.warning("MCP SSE 连接已断开，尝试重新连接...")
-                await mcp_client.__aexit__(None, None, None) # 先清理旧连接
-                mcp_client = Client(transport=mcp_server_url) 
-                await mcp_client.__aenter__()
-                logger.info("成功重新连接到MCP SSE服务器")
+            return await connect_mcp_client(request.app)
         except Exception as e:
-            logger.exception("检查或重新连接MCP SSE服务器时出错")
-            mcp_client = None # 连接失败，重置客户端
-            raise HTTPException(status_code=503, detail=f"MCP SSE服务器连接丢失: {e}")
-            
-    if mcp_client is None:
-         raise HTTPException(status_code=503, detail="无法获取有效的MCP客户端连接")
+            logger.exception(f"连接到MCP SSE服务器 {MCP_SERVER_URL} 时出错")
+            raise HTTPException(status_code=503, detail=f"无法连接到MCP SSE服务器: {e}")
+
+async def mcp_heartbeat(app: FastAPI, interval: float = MCP_HEARTBEAT_INTERVAL):
+    """后台心跳任务: 定期ping MCP服务器并更新连接健康标志，断开或尚未连接时尝试重连"""
+    state = app.state
+    while True:
+        await asyncio.sleep(interval)
+        if state.mcp_client is not None:
+            try:
+                await asyncio.wait_for(state.mcp_client.ping(), timeout=interval)
+                state.mcp_healthy = True
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"MCP SSE 心跳失败，尝试重新连接: {str(e)}")
+                state.mcp_healthy = False
 
-    return mcp_client
+        async with _connect_lock:
+            if state.mcp_healthy:
+                continue
+            try:
+                await connect_mcp_client(app)
+                logger.info("成功连接到MCP SSE服务器")
+            except Exception as e:
+                logger.error(f"连接MCP SSE服务器失败: {str(e)}")
+
+def build_tool_dict(tool) -> Dict[str, Any]:
+    """将MCP工具定义转换为工具字典，参数信息从 inputSchema 解析"""
+    parameters = []
+    input_schema = getattr(tool, "inputSchema", None)
+    if input_schema and isinstance(input_schema, dict):
+        properties = input_schema.get("properties")
+        if properties:
+            required_params = set(input_schema.get("required", ()))
+            for param_name, param_details in properties.items():
+                get_detail = param_details.get
+                parameters.append({
+                    "name": param_name,
+                    "type": get_detail("type", "any"),
+                    # 使用 title 作为描述，如果 description 存在则优先使用
+                    "description": get_detail("description", get_detail("title", "")),
+                    "required": param_name in required_params,
+                    "default": get_detail("default")
+                })
+
+    return {
+        "name": tool.name,
+        "description": tool.description,
+        "parameters": parameters
+    }
+
+def build_tool_validators(tools) -> Dict[str, Draft7Validator]:
+    """为每个工具的 inputSchema 构建一次参数校验器，schema无效的工具不做校验"""
+    validators = {}
+    for tool in tools:
+        input_schema = getattr(tool, "inputSchema", None)
+        if not isinstance(input_schema, dict):
+            continue
+        try:
+            Draft7Validator.check_schema(input_schema)
+        except SchemaError as e:
+            logger.warning(f"工具 {tool.name} 的 inputSchema 无效，跳过参数校验: {e.message}")
+            continue
+        validators[tool.name] = Draft7Validator(input_schema)
+    return validators
+
+def get_tool_validator(tool_name: str) -> Optional[Draft7Validator]:
+    """获取缓存的工具参数校验器，没有时返回None"""
+    return _tool_validators.get(tool_name)
+
+def get_llm() -> OpenAILLM:
+    """获取全局共享的LLM实例，首次调用时创建"""
+    global _llm_singleton
+
+    if _llm_singleton is None:
+        _llm_singleton = OpenAILLM()
+    return _llm_singleton
+
+async def load_mcp_definitions(client: Client) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """获取工具字典列表、参数校验器和资源信息 (不依赖LLM)，结果在MCP连接生命周期内缓存"""
+    global _tools_cache, _resources_cache, _tool_validators
+
+    if _tools_cache is None:
+        available_tools_raw = await client.list_tools()
+        _tools_cache = [build_tool_dict(tool) for tool in available_tools_raw]
+        _tool_validators = build_tool_validators(available_tools_raw)
+        logger.info(f"已缓存 {len(_tools_cache)} 个工具定义")
 
-@router.get("/", response_model=ToolListResponse)
-async def list_tools():
+    if _resources_cache is None:
+        available_resources_raw = await client.list_resources()
+        _resources_cache = [ # 资源URI和类型的简单列表
+            {"uri": res.uri, "type": getattr(res, 'mimeType', 'unknown')}
+            for res in available_resources_raw
+        ]
+        logger.info(f"已缓存 {len(_resources_cache)} 个资源定义")
+
+    return _tools_cache, _resources_cache
+
+async def get_formatted_tools(llm, client: Client) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """获取LLM格式的工具列表和资源信息，结果在MCP连接生命周期内缓存"""
+    global _formatted_tools_cache
+
+    tools, resources = await load_mcp_definitions(client)
+    if _formatted_tools_cache is None:
+        _formatted_tools_cache = llm.format_tools(tools)
+    return _formatted_tools_cache, resources
+
+@router.get("/", response_model=None, responses={200: {"model": ToolListResponse}})
+async def list_tools(client: Client = Depends(mcp_dep)):
     """获取所有可用MCP工具"""
     try:
-        client = await get_mcp_client()
         tools = await client.list_tools()
         logger.info(f"获取到的原始工具列表: {tools}")
         
         # 转换工具为适合输出的格式
-        tool_list = []
-        for tool in tools:
-            logger.info(f"处理工具: {tool.name}, 类型: {type(tool)}")
-            tool_dict = {
-                "name": tool.name,
-                "description": tool.description,
-                "parameters": []
-            }
-            # 从 inputSchema 解析参数信息
-            input_schema = getattr(tool, "inputSchema", None)
-            logger.info(f"工具 {tool.name} 的 inputSchema: {input_schema}, 类型: {type(input_schema)}")
-            
-            if input_schema and isinstance(input_schema, dict) and "properties" in input_schema:
-                properties = input_schema.get("properties", {})
-                required_params = input_schema.get("required", [])
-                
-                for param_name, param_details in properties.items():
-                    logger.info(f"  处理参数: {param_name}, 详情: {param_details}")
-                    param_info = {
-                        "name": param_name,
-                        "type": param_details.get("type", "any"),
-                        # 使用 title 作为描述，如果 description 存在则优先使用
-                        "description": param_details.get("description", param_details.get("title", "")),
-                        "required": param_name in required_params,
-                        "default": param_details.get("default", None)
-                    }
-                    logger.info(f"  提取的参数信息: {param_info}")
-                    tool_dict["parameters"].append(param_info)
-            
-            tool_list.append(tool_dict)
-        return {"tools": tool_list}
+        tool_list = [build_tool_dict(tool) for tool in tools]
+        return ORJSONResponse({"tools": tool_list})
     except Exception as e:
         logger.exception(f"获取工具列表时发生意外错误")
         raise HTTPException(status_code=500, detail=f"获取工具列表失败: {str(e)}")
 
 @router.post("/{tool_name}", response_model=ToolResponse)
-async def call_tool(tool_name: str, request: ToolRequest):
+async def call_tool(tool_name: str, request: ToolRequest, client: Client = Depends(mcp_dep)):
     """调用指定的MCP工具，可选择使用LLM"""
     try:
-        client = await get_mcp_client()
-        
         # --- 添加日志：检查传入的参数 --- 
         logger.info(f"准备调用工具: {tool_name}")
         logger.info(f"从请求接收到的参数 (request.params): {request.params}, 类型: {type(request.params)}")
@@ -148,8 +300,8 @@ async def call_tool(tool_name: str, request: ToolRequest):
                     请解释这个结果，并提供任何相关的分析或建议。
                     """
                     
-                    # 初始化OpenAI LLM并生成响应
-                    llm = OpenAILLM()
+                    # 使用共享的OpenAI LLM生成响应
+                    llm = get_llm()
                     llm_response = await llm.generate(
                         prompt=prompt.strip(),
                         system_message=request.system_message,
@@ -170,7 +322,7 @@ async def call_tool(tool_name: str, request: ToolRequest):
 async def process_with_llm(tools_list: List[Dict[str, Any]], prompt: str, system_message: Optional[str] = None):
     """使用工具列表和LLM处理请求"""
     try:
-        llm = OpenAILLM()
+        llm = get_llm()
         response = await llm.generate_with_tools(
             prompt=prompt,
             tools=tools_list,
@@ -181,17 +333,17 @@ async def process_with_llm(tools_list: List[Dict[str, Any]], prompt: str, system
         logger.error(f"LLM处理请求时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"LLM处理失败: {str(e)}")
 
+# 健康检查只有三种固定响应，预先序列化
+_HEALTH_NOT_CONNECTED = Response(content=orjson.dumps({"status": "未连接", "connected": False}), media_type="application/json")
+_HEALTH_CONNECTED = Response(content=orjson.dumps({"status": "已连接", "connected": True}), media_type="application/json")
+_HEALTH_DISCONNECTED = Response(content=orjson.dumps({"status": "连接已断开", "connected": False}), media_type="application/json")
+
 @router.get("/health")
-async def health_check():
+async def health_check(request: Request):
     """检查MCP客户端连接状态"""
-    global mcp_client
-    
-    if mcp_client is None:
-        return {"status": "未连接", "connected": False}
+    state = request.app.state
+    if getattr(state, "mcp_client", None) is None:
+        return _HEALTH_NOT_CONNECTED
     
-    try:
-        is_connected = await mcp_client.is_connected()
-        return {"status": "已连接" if is_connected else "连接已断开", "connected": is_connected}
-    except Exception as e:
-        logger.error(f"检查连接状态时出错: {str(e)}")
-        return {"status": f"检查连接状态时出错: {str(e)}", "connected": False} 
\ No newline at end of file
+    # 连接状态由后台心跳任务维护
+    return _HEALTH_CONNECTED if state.mcp_healthy else _HEALTH_DISCONNECTED 
\ No newline at end of file
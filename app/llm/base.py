@@ -10,6 +10,9 @@ logger = logging.getLogger("llm")
 class BaseLLM(ABC):
     """LLM处理的基类，定义了LLM交互的通用接口"""
     
+    # 使用 __slots__ 代替实例 __dict__，子类需同样声明 __slots__
+    __slots__ = ("model_name", "logger")
+    
     def __init__(self, model_name: str):
         self.model_name = model_name
         self.logger = logger
@@ -32,6 +35,7 @@ class BaseLLM(ABC):
         """使用工具生成响应"""
         pass
     
+    @abstractmethod
     def format_tools(self, tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """格式化工具列表以符合LLM的输入格式"""
-        return tools 
\ No newline at end of file
+        pass 
\ No newline at end of file
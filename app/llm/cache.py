@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+
+# 配置日志
+logger = logging.getLogger("llm.cache")
+
+# 语义缓存配置 (需要安装可选依赖: pip install -e ".[semantic-cache]")
+SEMANTIC_CACHE_ENABLED = os.getenv("LLM_SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_MODEL = os.getenv("LLM_SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("LLM_SEMANTIC_CACHE_SIZE", "1024"))
+# 精确匹配缓存容量，在语义缓存之前查询
+EXACT_CACHE_SIZE = int(os.getenv("LLM_EXACT_CACHE_SIZE", "10000"))
+
+# --- 精确匹配缓存 (LRU) ---
+# 请求参数摘要 -> 响应
+_exact_cache: "OrderedDict[bytes, Any]" = OrderedDict()
+# ------------------------------------
+
+
+def hash_text(text: Union[str, bytes, None]) -> bytes:
+    """计算文本的短摘要，用于缓存分区键"""
+    if not isinstance(text, bytes):
+        text = (text or "").encode()
+    return hashlib.blake2b(text, digest_size=16).digest()
+
+
+def exact_cache_key(*parts: Union[str, bytes, int, float, None]) -> bytes:
+    """根据请求参数 (模型、系统消息、提示词、温度等) 计算精确匹配缓存键"""
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        hasher.update(part if isinstance(part, bytes) else str(part).encode())
+        hasher.update(b"\x00") # 分隔各参数，避免拼接歧义
+    return hasher.digest()
+
+def exact_cache_get(key: bytes) -> Optional[Any]:
+    """查询精确匹配缓存，命中时更新LRU顺序"""
+    response = _exact_cache.get(key)
+    if response is not None:
+        _exact_cache.move_to_end(key)
+    return response
+
+def exact_cache_put(key: bytes, response: Any):
+    """写入精确匹配缓存，超出容量时淘汰最久未使用的条目"""
+    if EXACT_CACHE_SIZE <= 0:
+        return
+    _exact_cache[key] = response
+    _exact_cache.move_to_end(key)
+    while len(_exact_cache) > EXACT_CACHE_SIZE:
+        _exact_cache.popitem(last=False)
+
+
+class SemanticCache:
+    """基于句向量余弦相似度的LLM响应缓存
+
+    缓存按分区键 (模型、温度、系统消息摘要、工具定义摘要等) 隔离，只有分区键完全相同时
+    才比较提示词的相似度，避免不同系统消息或工具集的响应被错误复用。
+    """
+
+    def __init__(
+        self,
+        model_name: str = SEMANTIC_CACHE_MODEL,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        maxsize: int = SEMANTIC_CACHE_SIZE,
+    ):
+        import numpy as np
+
+        self._np = np
+        self.model_name = model_name
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._model = None
+        self._model_lock = threading.Lock()
+        # 分区键 -> {条目ID: (向量, 响应)}
+        self._partitions: Dict[Hashable, Dict[int, Tuple[Any, Any]]] = {}
+        # 分区键 -> (条目ID列表, 向量矩阵)，分区变化时重建
+        self._matrices: Dict[Hashable, Tuple[List[int], Any]] = {}
+        # 全局LRU顺序: 条目ID -> 分区键
+        self._lru: "OrderedDict[int, Hashable]" = OrderedDict()
+        self._next_id = 0
+
+    def _encode(self, text: str):
+        """计算归一化的句向量 (在线程池中运行，首次调用时加载模型)"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    logger.info("加载语义缓存向量模型: %s", self.model_name)
+                    self._model = SentenceTransformer(self.model_name, device="cpu")
+        return self._model.encode(text, normalize_embeddings=True)
+
+    async def embed(self, text: str):
+        """异步计算句向量，避免阻塞事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._encode, text)
+
+    def lookup(self, key: Hashable, embedding) -> Optional[Any]:
+        """在分区内查找最相似的缓存响应，相似度达到阈值时返回，否则返回None"""
+        entries = self._partitions.get(key)
+        if not entries:
+            return None
+
+        matrix_cache = self._matrices.get(key)
+        if matrix_cache is None:
+            ids = list(entries)
+            matrix_cache = (ids, self._np.stack([entries[entry_id][0] for entry_id in ids]))
+            self._matrices[key] = matrix_cache
+        ids, matrix = matrix_cache
+
+        # 向量已归一化，内积即余弦相似度
+        scores = matrix @ embedding
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+
+        entry_id = ids[best]
+        self._lru.move_to_end(entry_id)
+        logger.debug("语义缓存命中 (相似度: %.3f)", scores[best])
+        return entries[entry_id][1]
+
+    def store(self, key: Hashable, embedding, response: Any):
+        """写入缓存条目，超出容量时淘汰最久未使用的条目"""
+        entry_id = self._next_id
+        self._next_id += 1
+        self._partitions.setdefault(key, {})[entry_id] = (embedding, response)
+        self._matrices.pop(key, None)
+        self._lru[entry_id] = key
+
+        while len(self._lru) > self.maxsize:
+            old_id, old_key = self._lru.popitem(last=False)
+            partition = self._partitions[old_key]
+            del partition[old_id]
+            self._matrices.pop(old_key, None)
+            if not partition:
+                del self._partitions[old_key]
+
+
+# 全局语义缓存实例 (延迟创建)
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_checked = False
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """获取全局语义缓存，未启用 (LLM_SEMANTIC_CACHE!=1) 或缺少可选依赖时返回None"""
+    global _semantic_cache, _semantic_cache_checked
+
+    if not _semantic_cache_checked:
+        _semantic_cache_checked = True
+        if SEMANTIC_CACHE_ENABLED:
+            try:
+                import sentence_transformers  # noqa: F401
+                _semantic_cache = SemanticCache()
+            except ImportError:
+                logger.warning("已启用语义缓存但未安装 sentence-transformers/numpy，语义缓存不可用")
+    return _semantic_cache
@@ -1,23 +1,279 @@
 from .base import BaseLLM
-from typing import Dict, List, Any, Optional
+from .cache import exact_cache_get, exact_cache_key, exact_cache_put, get_semantic_cache, hash_text
+from typing import Dict, List, Any, AsyncIterator, Awaitable, Optional, Tuple, Union
+import asyncio
+import importlib.util
+import logging
+import weakref
+from functools import lru_cache
 import os
+import httpx
+import orjson
 # 导入正确的异步客户端
 from openai import AsyncOpenAI
 
+# OpenAI请求超时 (读/写60秒，建立连接5秒)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# 所有OpenAILLM实例共享的HTTP连接池，避免每个实例各自建连 (默认连接池上限较低)
+# 连接绑定创建它的事件循环，因此每个事件循环各用一个连接池 (循环关闭后自动释放)
+_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+# 是否绕过OpenAI SDK直接请求 /chat/completions (默认开启)，设置为0时使用SDK
+OPENAI_RAW_HTTP = os.getenv("OPENAI_RAW_HTTP", "1") != "0"
+# 429/5xx/连接错误时的最大重试次数 (SDK与直接HTTP请求一致)
+OPENAI_MAX_RETRIES = 2
+
+def _should_retry(status_code: int) -> bool:
+    """与SDK一致: 超时、冲突、限流和服务端错误可以重试"""
+    return status_code in (408, 409, 429) or status_code >= 500
+
+def _retry_delay(response: Optional[httpx.Response], attempt: int) -> float:
+    """重试等待时间: 优先使用 Retry-After(-ms) 响应头，否则指数退避"""
+    if response is not None:
+        headers = response.headers
+        try:
+            if "retry-after-ms" in headers:
+                return min(float(headers["retry-after-ms"]) / 1000, 60.0)
+            if "retry-after" in headers:
+                return min(float(headers["retry-after"]), 60.0)
+        except ValueError:
+            pass # HTTP日期格式等，退回指数退避
+    return min(0.5 * 2 ** attempt, 8.0)
+
+def _raise_api_error(response: httpx.Response):
+    """抛出包含OpenAI错误信息 (error.message) 的HTTP状态异常"""
+    try:
+        message = orjson.loads(response.content)["error"]["message"]
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        message = response.text[:500] or response.reason_phrase
+    raise httpx.HTTPStatusError(
+        f"OpenAI API错误 ({response.status_code}): {message}", request=response.request, response=response
+    )
+
+def _build_messages(prompt: str, system_message: Optional[str]) -> List[Dict[str, str]]:
+    """构建单轮对话的消息列表 (可选的系统消息 + 用户提示词)"""
+    if system_message:
+        return [{"role": "system", "content": system_message}, {"role": "user", "content": prompt}]
+    return [{"role": "user", "content": prompt}]
+
+def _normalize_tool_calls(data: Dict[str, Any]) -> Dict[str, Any]:
+    """将响应中缺失或为null的 tool_calls 统一为空列表"""
+    for choice in data["choices"]:
+        if not choice["message"].get("tool_calls"):
+            choice["message"]["tool_calls"] = []
+    return data
+
+@lru_cache(maxsize=64)
+def _translate_tools(tools_json: bytes) -> List[Dict[str, Any]]:
+    """将MCP工具 (JSON编码的工具字典列表) 转换为OpenAI工具格式，工具集不变时直接复用结果"""
+    tools = orjson.loads(tools_json)
+    openai_tools = []
+
+    for tool in tools:
+        openai_tool = {
+            "type": "function",
+            "function": {
+                "name": tool.get("name", ""),
+                "description": tool.get("description", ""),
+                "parameters": {"type": "object", "properties": {}, "required": []},
+            },
+        }
+
+        # 处理参数
+        if "parameters" in tool and isinstance(tool["parameters"], list):
+            for param in tool["parameters"]:
+                param_name = param.get("name", "")
+                param_type = param.get("type", "string")
+                param_desc = param.get("description", "")
+                param_required = param.get("required", False)
+
+                openai_tool["function"]["parameters"]["properties"][param_name] = {
+                    "type": param_type,
+                    "description": param_desc,
+                }
+
+                if param_required:
+                    openai_tool["function"]["parameters"]["required"].append(
+                        param_name
+                    )
+
+        openai_tools.append(openai_tool)
+
+    return openai_tools
+
+async def _call_with_log(
+    call: Awaitable[Any], logger: logging.Logger, tag: str
+) -> Tuple[Optional[Any], Optional[Exception]]:
+    """等待一次OpenAI调用，返回 (响应, None)；出错时记录日志并返回 (None, 异常)"""
+    try:
+        return await call, None
+    except Exception as e:
+        logger.error("调用OpenAI API (%s) 时出错: %s", tag, e)
+        return None, e
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取当前事件循环共享的HTTP连接池，首次调用时创建 (安装了 h2 时启用HTTP/2)"""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None:
+        client = _http_clients[loop] = httpx.AsyncClient(
+            # 空闲连接保留60秒 (httpx默认5秒)，预热和请求间隙建立的连接可以被复用
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=200, keepalive_expiry=60.0),
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=HTTP_TIMEOUT,
+        )
+    return client
+
+async def close_http_client():
+    """关闭当前事件循环的共享HTTP连接池，应用关闭时调用"""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
 
 class OpenAILLM(BaseLLM):
     """OpenAI API实现的LLM处理类，使用OpenAI官方库"""
 
+    __slots__ = ("api_key", "base_url", "raw_http", "_clients", "_chat_url", "_headers", "semantic_cache")
+
     def __init__(
-        self, model_name: str = "gpt-4o", api_key: Optional[str] = None
+        self,
+        model_name: str = "gpt-4o",
+        api_key: Optional[str] = None,
+        raw_http: bool = OPENAI_RAW_HTTP,
     ):
         super().__init__(model_name)
         self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
         if not self.api_key:
-            self.logger.warning("未设置OpenAI API密钥，请通过环境变量设置或直接传入")
+            # 启动时即失败，避免每次请求检查密钥
+            raise RuntimeError("未设置OpenAI API密钥 (OPENAI_API_KEY)，请通过环境变量设置或直接传入")
+
+        # 异步OpenAI客户端按事件循环延迟创建 (见 client 属性)
+        self.base_url = os.environ.get("OPENAI_BASE_URL") or "https://api.openai.com/v1"
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+        # 直接HTTP请求使用的地址和请求头 (base_url 与SDK一致)
+        self.raw_http = raw_http
+        self._chat_url = f"{self.base_url.rstrip('/')}/chat/completions"
+        self._headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+        # 语义缓存 (LLM_SEMANTIC_CACHE=1 且安装了可选依赖时启用)
+        self.semantic_cache = get_semantic_cache()
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """当前事件循环上的AsyncOpenAI客户端，复用该循环的共享HTTP连接池，首次访问时创建"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=get_http_client(),
+                timeout=HTTP_TIMEOUT,
+                max_retries=OPENAI_MAX_RETRIES,
+            )
+        return client
+
+    async def warmup(self):
+        """预热: 建立到API的连接 (完成TLS握手后保留在连接池中)，并加载语义缓存的向量模型"""
+        response = await get_http_client().get(f"{self.base_url.rstrip('/')}/models", headers=self._headers)
+        self.logger.info("OpenAI连接预热完成 (状态码: %d)", response.status_code)
+        if self.semantic_cache is not None:
+            await self.semantic_cache.embed("warmup")
+
+    async def _send_chat(self, body: Dict[str, Any], stream: bool = False) -> httpx.Response:
+        """直接请求 /chat/completions
+
+        429/5xx和连接错误时按 Retry-After 或指数退避重试，最终失败时抛出带OpenAI错误信息的异常。
+        stream=True 时调用方负责关闭返回的响应。
+        """
+        client = get_http_client()
+        content = orjson.dumps(body)
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            can_retry = attempt < OPENAI_MAX_RETRIES
+            try:
+                request = client.build_request("POST", self._chat_url, content=content, headers=self._headers)
+                response = await client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                if not can_retry:
+                    raise
+                delay = _retry_delay(None, attempt)
+                self.logger.warning("请求OpenAI API失败 (%s)，%.1f秒后重试", e, delay)
+            else:
+                if response.is_success:
+                    return response
+                if stream:
+                    await response.aread()
+                    await response.aclose()
+                if not (can_retry and _should_retry(response.status_code)):
+                    _raise_api_error(response)
+                delay = _retry_delay(response, attempt)
+                self.logger.warning("OpenAI API返回 %d，%.1f秒后重试", response.status_code, delay)
+            await asyncio.sleep(delay)
 
-        # 初始化正确的异步OpenAI客户端
-        self.client = AsyncOpenAI(api_key=self.api_key)
+    async def _post_chat(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """直接请求 /chat/completions，使用orjson编解码，返回原始响应字典 (跳过SDK对象构建)"""
+        response = await self._send_chat(body)
+        return orjson.loads(response.content)
+
+    async def chat_completion(self, **params) -> Dict[str, Any]:
+        """调用 chat completions 接口，返回响应字典
+
+        默认直接HTTP请求并用orjson解析；raw_http=False 时经SDK请求并转换为相同结构的字典。
+        """
+        body = {"model": self.model_name, **params}
+        if self.raw_http:
+            return await self._post_chat(body)
+        response = await self.client.chat.completions.create(**body)
+        return response.model_dump(mode="json")
+
+    async def chat_completion_stream(self, **params) -> AsyncIterator[Dict[str, Any]]:
+        """流式调用 chat completions 接口，逐个产出响应块字典
+
+        默认直接读取SSE事件流，按行切分后用orjson解析每个事件；raw_http=False 时经SDK请求。
+        """
+        body = {"model": self.model_name, **params, "stream": True}
+        if self.raw_http:
+            response = await self._send_chat(body, stream=True)
+            try:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue # 空行、注释和心跳
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    yield orjson.loads(data)
+            finally:
+                await response.aclose()
+            return
+
+        response = await self.client.chat.completions.create(**body)
+        async for chunk in response:
+            yield chunk.model_dump(mode="json")
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+    ) -> AsyncIterator[str]:
+        """流式生成文本响应，逐段产出生成的文本 (需要完整文本时用 "".join 拼接)"""
+        messages = _build_messages(prompt, system_message)
+
+        async for chunk in self.chat_completion_stream(
+            messages=messages, temperature=temperature, max_tokens=max_tokens
+        ):
+            if not chunk["choices"]:
+                continue
+            content = chunk["choices"][0]["delta"].get("content")
+            if content:
+                yield content
 
     async def generate(
         self,
@@ -26,33 +282,84 @@ class OpenAILLM(BaseLLM):
         temperature: float = 0.7,
         max_tokens: int = 1000,
     ) -> str:
-        """生成文本响应"""
-        # 检查API Key是否存在
-        if not self.api_key:
-            self.logger.error("OpenAI API key is missing. Cannot generate.")
-            return "生成失败: Missing API key"
+        """生成文本响应，出错时返回错误描述字符串"""
+        content, error = await _call_with_log(
+            self._generate_text(prompt, system_message, temperature, max_tokens), self.logger, "generate"
+        )
+        if error is not None:
+            return f"生成失败: {str(error)}"
+        return content
 
-        messages = []
+    async def _generate_text(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+    ) -> str:
+        """生成文本响应 (经过精确/语义缓存)，出错时抛出异常"""
+        messages = _build_messages(prompt, system_message)
 
-        if system_message:
-            messages.append({"role": "system", "content": system_message})
+        body = {
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
 
-        messages.append({"role": "user", "content": prompt})
+        # 先查询精确匹配缓存 (temperature=0 的确定性请求，或已启用语义缓存时)
+        use_exact_cache = temperature == 0 or self.semantic_cache is not None
+        if use_exact_cache:
+            exact_key = exact_cache_key(self.model_name, system_message, prompt, temperature, max_tokens)
+            cached = exact_cache_get(exact_key)
+            if cached is not None:
+                return cached
 
-        try:
-            # 现在可以正确 await 异步方法
-            response = await self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
+        # 再查询语义缓存: 模型、温度、长度限制和系统消息相同且提示词语义相近时直接返回
+        embedding = None
+        if self.semantic_cache is not None:
+            cache_key = (self.model_name, round(temperature, 1), max_tokens, hash_text(system_message))
+            embedding = await self.semantic_cache.embed(prompt)
+            cached = self.semantic_cache.lookup(cache_key, embedding)
+            if cached is not None:
+                exact_cache_put(exact_key, cached)
+                return cached
+
+        data = await self.chat_completion(**body)
+        content = data["choices"][0]["message"]["content"]
 
-            return response.choices[0].message.content
+        # 只缓存成功的响应
+        if content:
+            if use_exact_cache:
+                exact_cache_put(exact_key, content)
+            if embedding is not None:
+                self.semantic_cache.store(cache_key, embedding, content)
+        return content
 
-        except Exception as e:
-            self.logger.error(f"调用OpenAI API时出错: {str(e)}")
-            return f"生成失败: {str(e)}"
+    async def generate_many(
+        self,
+        prompts: List[Tuple[str, Optional[str]]],
+        concurrency: Optional[int] = None,
+        **kwargs,
+    ) -> List[Union[str, BaseException]]:
+        """并发生成多个文本响应
+
+        prompts 为 (提示词, 系统消息) 列表，其余参数 (temperature、max_tokens) 与 generate 相同；
+        结果按输入顺序返回，出错的位置为异常对象 (不同于 generate 返回的错误字符串)。concurrency 限制同时进行的请求数，避免超出API速率限制。
+        """
+        if concurrency:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def generate_limited(prompt: str, system_message: Optional[str]) -> str:
+                async with semaphore:
+                    return await self._generate_text(prompt, system_message, **kwargs)
+        else:
+            async def generate_limited(prompt: str, system_message: Optional[str]) -> str:
+                return await self._generate_text(prompt, system_message, **kwargs)
+
+        return await asyncio.gather(
+            *(generate_limited(prompt, system_message) for prompt, system_message in prompts),
+            return_exceptions=True,
+        )
 
     async def generate_with_tools(
         self,
@@ -62,97 +369,46 @@ class OpenAILLM(BaseLLM):
         temperature: float = 0.7,
     ) -> Dict[str, Any]:
         """使用工具生成响应"""
-        # 检查API Key是否存在
-        if not self.api_key:
-            self.logger.error("OpenAI API key is missing. Cannot generate with tools.")
-            return {"error": "Missing API key"}
+        messages = _build_messages(prompt, system_message)
 
-        messages = []
+        tools_json = orjson.dumps(tools)
+        formatted_tools = _translate_tools(tools_json)
 
-        if system_message:
-            messages.append({"role": "system", "content": system_message})
+        body = {
+            "messages": messages,
+            "tools": formatted_tools,
+            "temperature": temperature,
+        }
 
-        messages.append({"role": "user", "content": prompt})
+        # 先查询精确匹配缓存，再查询语义缓存: 工具定义必须完全一致，避免不同工具集的响应被复用
+        use_exact_cache = temperature == 0 or self.semantic_cache is not None
+        if use_exact_cache:
+            tools_hash = hash_text(tools_json)
+            exact_key = exact_cache_key(self.model_name, system_message, prompt, temperature, tools_hash)
+            cached = exact_cache_get(exact_key)
+            if cached is not None:
+                return cached
 
-        formatted_tools = self.format_tools(tools)
+        embedding = None
+        if self.semantic_cache is not None:
+            cache_key = (self.model_name, round(temperature, 1), hash_text(system_message), tools_hash)
+            embedding = await self.semantic_cache.embed(prompt)
+            cached = self.semantic_cache.lookup(cache_key, embedding)
+            if cached is not None:
+                exact_cache_put(exact_key, cached)
+                return cached
 
-        try:
-            # 现在可以正确 await 异步方法
-            response = await self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                tools=formatted_tools,
-                temperature=temperature,
-            )
+        data, error = await _call_with_log(self.chat_completion(**body), self.logger, "generate_with_tools")
+        if error is not None:
+            return {"error": str(error)}
+        _normalize_tool_calls(data)
 
-            # 转换响应为字典格式
-            return {
-                "id": response.id,
-                "object": response.object,
-                "created": response.created,
-                "model": response.model,
-                "choices": [
-                    {
-                        "index": choice.index,
-                        "message": {
-                            "role": choice.message.role,
-                            "content": choice.message.content,
-                            "tool_calls": [
-                                {
-                                    "id": tool_call.id,
-                                    "type": tool_call.type,
-                                    "function": {
-                                        "name": tool_call.function.name,
-                                        "arguments": tool_call.function.arguments,
-                                    },
-                                }
-                                for tool_call in (choice.message.tool_calls or [])
-                            ]
-                            if choice.message.tool_calls
-                            else [],
-                        },
-                        "finish_reason": choice.finish_reason,
-                    }
-                    for choice in response.choices
-                ],
-            }
-
-        except Exception as e:
-            self.logger.error(f"调用OpenAI API with tools时出错: {str(e)}")
-            return {"error": str(e)}
+        if use_exact_cache:
+            exact_cache_put(exact_key, data)
+        if embedding is not None:
+            self.semantic_cache.store(cache_key, embedding, data)
+        return data
 
     def format_tools(self, tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """将MCP工具转换为OpenAI工具格式"""
-        openai_tools = []
-
-        for tool in tools:
-            openai_tool = {
-                "type": "function",
-                "function": {
-                    "name": tool.get("name", ""),
-                    "description": tool.get("description", ""),
-                    "parameters": {"type": "object", "properties": {}, "required": []},
-                },
-            }
-
-            # 处理参数
-            if "parameters" in tool and isinstance(tool["parameters"], list):
-                for param in tool["parameters"]:
-                    param_name = param.get("name", "")
-                    param_type = param.get("type", "string")
-                    param_desc = param.get("description", "")
-                    param_required = param.get("required", False)
-
-                    openai_tool["function"]["parameters"]["properties"][param_name] = {
-                        "type": param_type,
-                        "description": param_desc,
-                    }
-
-                    if param_required:
-                        openai_tool["function"]["parameters"]["required"].append(
-                            param_name
-                        )
-
-            openai_tools.append(openai_tool)
-
-        return openai_tools
+        """将MCP工具转换为OpenAI工具格式 (按工具定义缓存转换结果，返回的列表为共享对象，不可修改)"""
+        return _translate_tools(orjson.dumps(tools))
@@ -1,12 +1,20 @@
 from fastmcp import FastMCP
-import asyncio
+from typing import Callable, List
+import inspect
+import logging
+
+# 配置日志
+logger = logging.getLogger("mcp_server")
 
 
 class BaseMCPServer:
     """MCP服务器基类，可以被继承扩展"""
     
+    __slots__ = ("mcp", "logger")
+    
     def __init__(self, name: str = "基础MCP服务器"):
         self.mcp = FastMCP(name)
+        self.logger = logger
         self._register_tools()
         self._register_resources()
     
@@ -18,9 +26,22 @@ class BaseMCPServer:
         """注册资源，子类应该重写此方法"""
         pass
     
+    def register_tools_bulk(self, fns: List[Callable]):
+        """一次注册多个同步工具
+
+        简单的纯计算工具应使用 def 定义: FastMCP 会直接调用同步函数，不经过协程调度。
+        先校验全部函数再注册，误用 async def 定义时在注册阶段报错，且不注册任何工具。
+        """
+        async_tools = [fn.__name__ for fn in fns if inspect.iscoroutinefunction(fn)]
+        if async_tools:
+            raise TypeError(f"工具 {', '.join(async_tools)} 是协程函数，同步工具必须使用 def 定义")
+        add_tool = self.mcp.add_tool
+        for fn in fns:
+            add_tool(fn)
+    
     async def run(self, transport: str = "sse", host: str = "127.0.0.1", port: int = 8001):
         """运行MCP服务器 (异步)"""
-        print(f"运行MCP服务器，端口: {port}")
+        self.logger.info("运行MCP服务器，传输: %s，端口: %d", transport, port)
         if transport == "sse":
             await self.mcp.run_sse_async(host=host, port=port)
         elif transport == "stdio":
@@ -28,7 +49,7 @@ class BaseMCPServer:
             await self.mcp.run_stdio_async()
         else:
             # 默认或未知传输，可以尝试通用运行或抛出错误
-            print(f"警告: 不支持的传输类型 {transport}，尝试默认运行")
+            self.logger.warning("不支持的传输类型 %s，尝试默认运行", transport)
             # 注意：如果通用 run 有问题，这里可能仍然失败
             await self.mcp.run_async(transport=transport, host=host, port=port)
     
@@ -1,51 +1,53 @@
-from datetime import datetime
+import time
 from app.mcp_server.base import BaseMCPServer
 
 
+# --- 工具函数 (模块级定义，注册时直接使用，不依赖服务器实例) ---
+# 各语言的问候语模板
+_GREETINGS = {
+    "中文": "你好，{}！",
+    "英文": "Hello, {}!",
+    "日文": "こんにちは、{}さん！",
+}
+
+def add(a: int, b: int) -> int:
+    """将两个数字相加"""
+    return a + b
+
+def greet(name: str, language: str = "中文") -> str:
+    """根据指定语言问候用户"""
+    return _GREETINGS.get(language, _GREETINGS["中文"]).format(name)
+
+def get_time() -> str:
+    """获取当前时间"""
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+def get_time_zone() -> str:
+    """获取当前时区"""
+    # 按当前是否处于夏令时选择时区名称 (naive datetime 的 %Z 总是返回空字符串)
+    return time.tzname[time.localtime().tm_isdst > 0]
+
+def duck_duck_go(query: str) -> str:
+    """使用duckduckgo搜索"""
+    return f"使用duckduckgo搜索: {query}"
+
+def get_cat_image() -> str:
+    """获取随机图片"""
+    return "https://picsum.photos/200"
+# ------------------------------------
+
+
 class SimpleMCPServer(BaseMCPServer):
     """简单MCP服务器示例，提供基本工具和资源"""
     
+    __slots__ = ()
+    
     def __init__(self):
         super().__init__(name="简单示例 🚀")
     
     def _register_tools(self):
         """注册工具"""
-        
-        @self.mcp.tool()
-        def add(a: int, b: int) -> int:
-            """将两个数字相加"""
-            return a + b
-        
-        @self.mcp.tool()
-        def greet(name: str, language: str = "中文") -> str:
-            """根据指定语言问候用户"""
-            greetings = {
-                "中文": f"你好，{name}！",
-                "英文": f"Hello, {name}!",
-                "日文": f"こんにちは、{name}さん！",
-            }
-            return greetings.get(language, greetings["中文"])
-
-        @self.mcp.tool()
-        def get_time() -> str:
-            """获取当前时间"""
-            return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        @self.mcp.tool()
-        def get_time_zone() -> str:
-            """获取当前时区"""
-            return datetime.now().strftime("%Z")
-
-        @self.mcp.tool()
-        def duck_duck_go(query: str) -> str:
-            """使用duckduckgo搜索"""
-            return f"使用duckduckgo搜索: {query}"
-        
-        @self.mcp.tool()
-        def get_cat_image() -> str:
-            """获取随机图片"""
-            return "https://picsum.photos/200"
-        
+        self.register_tools_bulk([add, greet, get_time, get_time_zone, duck_duck_go, get_cat_image])
         
     def _register_resources(self):
         """注册资源"""
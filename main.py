@@ -4,15 +4,43 @@ import logging
 import sys
 import os
 import asyncio
+from typing import Optional
+
+# uvloop/httptools 由 uvicorn[standard] 安装 (Windows 上不可用)，缺失时回退到默认实现
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+try:
+    import httptools
+except ImportError:
+    httptools = None
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("main")
 
-def run_api_server(host: str = "0.0.0.0", port: int = 8080, reload: bool = False):
-    """运行FastAPI服务器"""
-    logger.info(f"启动API服务器 - 地址: {host}, 端口: {port}")
-    uvicorn.run("app.api:app", host=host, port=port, reload=reload)
+def run_api_server(host: str = "0.0.0.0", port: int = 8080, reload: bool = False,
+                   workers: Optional[int] = None, access_log: bool = False):
+    """运行FastAPI服务器
+
+    默认按CPU核数启动多个worker进程 (热重载模式只能使用单进程)，并关闭逐请求的访问日志。
+    """
+    if reload:
+        workers = 1
+    elif not workers:
+        workers = os.cpu_count() or 1
+    logger.info(f"启动API服务器 - 地址: {host}, 端口: {port}, worker数: {workers}")
+    uvicorn.run(
+        "app.api:app",
+        host=host,
+        port=port,
+        reload=reload,
+        workers=workers,
+        access_log=access_log,
+        loop="uvloop" if uvloop else "auto",
+        http="httptools" if httptools else "auto",
+    )
 
 async def run_mcp_server(transport: str = "sse", host: str = "127.0.0.1", port: int = 8001):
     """直接运行MCP服务器 (异步)"""
@@ -33,15 +61,19 @@ def main():
     parser.add_argument("--mcp-port", type=int, default=8001, help="MCP服务器端口 (仅mcp模式)")
     parser.add_argument("--mcp-transport", type=str, default="sse", choices=["sse", "stdio"], help="MCP服务器传输模式 (仅mcp模式)")
     parser.add_argument("--reload", action="store_true", help="是否启用热重载 (仅对API服务器有效)")
+    parser.add_argument("--workers", type=int, default=None, help="API服务器worker进程数 (默认CPU核数，热重载时为1)")
+    parser.add_argument("--access-log", action="store_true", help="是否启用API服务器访问日志 (默认关闭)")
     
     args = parser.parse_args()
     
     # 根据模式运行相应的服务器
     if args.mode == "api":
-        run_api_server(args.host, args.port, args.reload)
+        run_api_server(args.host, args.port, args.reload, args.workers, args.access_log)
     elif args.mode == "mcp":
+        # 使用uvloop事件循环运行MCP服务器 (可用时)
+        runner = uvloop.run if uvloop else asyncio.run
         try:
-            asyncio.run(run_mcp_server(transport=args.mcp_transport, host=args.mcp_host, port=args.mcp_port))
+            runner(run_mcp_server(transport=args.mcp_transport, host=args.mcp_host, port=args.mcp_port))
         except KeyboardInterrupt:
             logger.info("MCP服务器已停止")
     else: